@@ -1,10 +1,16 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
 from itertools import product
-from os import mkdir
+import json
+from os import listdir, mkdir
 from os.path import exists
 from shutil import rmtree
-from itertools import chain
-from .util import TIS
+from threading import Lock
+from itertools import chain, islice
+from .util import ImageWriter, TIS
 
+import numpy as np
 from tqdm import tqdm
 
 
@@ -16,20 +22,77 @@ class Fragment:
     def __init__(self, tid):
         self.tid = tid
 
-    def n_fragmaent(self, i):
+    # float64 counts below this are exact, larger ones are redone with Python ints
+    EXACT = 2 ** 53
+
+    def n_fragmaent(self, i) -> dict[str, int]:
         """
         for the tile i, how many fragments can it generate?
+        the number yielded by CENTER(i), CORNER(i) and SIDE(i), counted from
+        the adjacency matrices without enumerating them
         """
         assert 0 <= i < self.tid.n
-        A = self.tid.nids(i, 0)
-        B = self.tid.nids(i, 1)
-        C = self.tid.nids(i, 2)
-        D = self.tid.nids(i, 3)
-        a = len(A)
-        b = len(B)
-        c = len(C)
-        d = len(D)
-        print(a, b, c, d, a * b * c * d)
+        return {name: int(n[0]) for name, n in self.counts([i]).items()}
+
+    def counts(self, tiles=None) -> dict[str, np.ndarray]:
+        """
+        per tile fragment counts of each algorithm for tiles (default all),
+        int64 arrays, or object arrays of Python ints once they pass EXACT
+        """
+        tiles = np.arange(self.tid.n) if tiles is None else np.asarray(tiles, dtype=np.intp)
+        out = {}
+        for name in ("CENTER", "CORNER", "SIDE"):
+            n = self._count(name, tiles, np.float64)
+            if n.max(initial=0) < self.EXACT:
+                out[name] = n.astype(np.int64)
+            else:
+                out[name] = self._count(name, tiles, object)
+        return out
+
+    def _count(self, name, tiles, dtype, block=2 ** 22):
+        """
+        Count the fragments of name for tiles by contracting the adjacency
+        matrices along the algorithm's loops, batched over blocks of tiles
+        so no intermediate holds more than about `block` entries.
+        M[d][u, v] = 1 iff v in nids(u, d) and
+        P(x, y)[u, v] = |nids(u, x) & nids(v, y)|, the size of an intersect
+        """
+        n = self.tid.n
+        M = self.tid.compat.transpose(1, 0, 2).astype(dtype)
+
+        pairs = {}
+
+        def P(x, y):
+            if (x, y) not in pairs:
+                pairs[x, y] = M[x] @ M[y].T
+            return pairs[x, y]
+
+        out = np.zeros(len(tiles), dtype=dtype)
+        step = max(1, block // max(1, n * n))
+        for start in range(0, len(tiles), step):
+            T = tiles[start : start + step]
+            match name:
+                case "CENTER":
+                    A, B, C, D = (M[d][T] for d in range(4))
+                    # corners e, f, g, h close the cycle a f b g c h d e around t,
+                    # (k, c, a) arrays
+                    left = P(1, 2) @ (B[:, :, None] * P(0, 1))
+                    right = P(3, 2) @ (D[:, :, None] * P(0, 3))
+                    n_t = (C[:, :, None] * left * right * A[:, None, :]).sum(axis=(1, 2))
+                case "CORNER":
+                    B, D = M[0][T], M[3][T]
+                    # (k, e, h) and (k, e, f), e the tile diagonal to t
+                    Ph = M[3] * (P(3, 2).T @ (D[:, :, None] * M[0])).transpose(0, 2, 1)
+                    Qf = M[0] * (P(0, 1).T @ (B[:, :, None] * M[3])).transpose(0, 2, 1)
+                    n_t = ((Ph @ P(0, 3)) * Qf).sum(axis=(1, 2))
+                case "SIDE":
+                    A, C, E = M[2][T], M[0][T], M[3][T]
+                    # (k, e, h)
+                    Dh = (M[2] * (A @ M[3])[:, None, :]) @ P(3, 2)
+                    Fh = (M[0] * (C @ M[3])[:, None, :]) @ P(0, 3).T
+                    n_t = (E[:, :, None] * M[3] * Dh * Fh).sum(axis=(1, 2))
+            out[start : start + len(T)] = n_t
+        return out
 
     def _core(self, i):
         """
@@ -69,12 +132,6 @@ class Fragment:
         """
         Implementation of the CENTER algorithm
         """
-
-        def intersect(u, x, v, y):
-            A = set(self.tid.nids(u, x))
-            B = set(self.tid.nids(v, y))
-            return A.intersection(B)
-
         assert 0 <= t < self.tid.n
 
         A = self.tid.nids(t, 0)
@@ -83,10 +140,10 @@ class Fragment:
         D = self.tid.nids(t, 3)
 
         for a, b, c, d in product(A, B, C, D):
-            E = intersect(d, 0, a, 3)
-            F = intersect(b, 0, a, 1)
-            G = intersect(c, 1, b, 2)
-            H = intersect(c, 3, d, 2)
+            E = self.tid.intersect(d, 0, a, 3)
+            F = self.tid.intersect(b, 0, a, 1)
+            G = self.tid.intersect(c, 1, b, 2)
+            H = self.tid.intersect(c, 3, d, 2)
             for e, f, g, h in product(E, F, G, H):
                 yield self._yield(g, b, f, c, t, a, h, d, e)
 
@@ -126,65 +183,453 @@ class Fragment:
                 for g, i in product(G, I):
                     yield self._yield(a, t, c, d, e, f, g, h, i)
 
-    def _dump_all(self, f, name: str):
+    # bulk enumeration plans, the variables after the seed t in the order
+    # the generators above bind them, each with the (variable, direction)
+    # pairs it must be a neighbor of, and the _yield arguments by name
+    PLANS = {
+        "CENTER": (
+            (
+                ("a", (("t", 0),)),
+                ("b", (("t", 1),)),
+                ("c", (("t", 2),)),
+                ("d", (("t", 3),)),
+                ("e", (("d", 0), ("a", 3))),
+                ("f", (("b", 0), ("a", 1))),
+                ("g", (("c", 1), ("b", 2))),
+                ("h", (("c", 3), ("d", 2))),
+            ),
+            "gbfctahde",
+        ),
+        "CORNER": (
+            (
+                ("b", (("t", 0),)),
+                ("d", (("t", 3),)),
+                ("e", (("b", 3), ("d", 0))),
+                ("f", (("e", 0),)),
+                ("h", (("e", 3),)),
+                ("i", (("h", 0), ("f", 3))),
+                ("g", (("d", 3), ("h", 2))),
+                ("c", (("b", 0), ("f", 1))),
+            ),
+            "tbcdefghi",
+        ),
+        "SIDE": (
+            (
+                ("a", (("t", 2),)),
+                ("c", (("t", 0),)),
+                ("e", (("t", 3),)),
+                ("d", (("a", 3), ("e", 2))),
+                ("f", (("e", 0), ("c", 3))),
+                ("h", (("e", 3),)),
+                ("g", (("d", 3), ("h", 2))),
+                ("i", (("h", 0), ("f", 3))),
+            ),
+            "atcdefghi",
+        ),
+    }
+
+    def bulk(self, name: str, tiles=None, chunk: int = 2 ** 16):
+        """
+        Vectorized CENTER, CORNER or SIDE (by name) for tiles (a tile id or
+        a list, all tiles by default), yields (k, 3, 3) int16 arrays of at
+        most chunk fragments, the same fragments the generator yields.
+        Partial fragments are extended one variable at a time through the
+        neighbor lists of _neighbors, splitting whenever more than chunk
+        of them are alive, so the work follows the fragments produced.
+        """
+        plan, layout = self.PLANS[name]
+        if tiles is None:
+            tiles = range(self.tid.n)
+        elif isinstance(tiles, int):
+            tiles = [tiles]
+        names = ["t"] + [v for v, _ in plan]
+        steps = [[(names.index(u), d) for u, d in rules] for _, rules in plan]
+        # columns of the flattened 3x3 fragment, _yield is column major
+        columns = [names.index(layout[j]) for j in (0, 3, 6, 1, 4, 7, 2, 5, 8)]
+        seeds = np.array(list(tiles), dtype=np.intp).reshape(-1, 1)
+        for part in self._extend(seeds, steps, chunk):
+            yield part[:, columns].astype(np.int16).reshape(-1, 3, 3)
+
+    def _neighbors(self, directions):
+        """
+        Neighbor lists in CSR form for one or two directions, the tiles in
+        nids(u, x) (and nids(v, y)) are indices[indptr[key]:indptr[key + 1]]
+        with key u (or u * n + v). Built from the compat tensor on first use.
+        """
+        if not hasattr(self, "_csr"):
+            self._csr = {}
+        if directions not in self._csr:
+            compat = self.tid.compat
+            if len(directions) == 1:
+                blocks = [compat[:, directions[0]]]
+            else:
+                x, y = directions
+                blocks = [compat[u, x] & compat[:, y] for u in range(self.tid.n)]
+            counts, indices = [], []
+            for allowed in blocks:
+                counts.append(allowed.sum(axis=1))
+                indices.append(np.nonzero(allowed)[1])
+            indptr = np.zeros(1 + sum(len(c) for c in counts), dtype=np.intp)
+            np.cumsum(np.concatenate(counts), out=indptr[1:])
+            self._csr[directions] = indptr, np.concatenate(indices).astype(np.intp)
+        return self._csr[directions]
+
+    def _extend(self, rows, steps, chunk):
+        if not steps:
+            yield rows
+            return
+        indptr, indices = self._neighbors(tuple(d for _, d in steps[0]))
+        key = np.zeros(len(rows), dtype=np.intp)
+        for u, _ in steps[0]:
+            key = key * self.tid.n + rows[:, u]
+        start = indptr[key]
+        count = indptr[key + 1] - start
+        k = np.repeat(np.arange(len(rows)), count)
+        # position of each new tile in its neighbor list
+        offset = np.arange(len(k)) - np.repeat(np.cumsum(count) - count, count)
+        v = indices[start[k] + offset]
+        rows = np.concatenate((rows[k], v[:, None]), axis=1)
+        for begin in range(0, len(rows), chunk):
+            yield from self._extend(rows[begin : begin + chunk], steps[1:], chunk)
+
+    def array(self, name: str, tiles=None) -> np.ndarray:
+        """every fragment bulk(name, tiles) yields as one (k, 3, 3) array"""
+        return np.concatenate([np.empty((0, 3, 3), np.int16), *self.bulk(name, tiles)])
+
+    def satisfies(self, name: str, frags) -> np.ndarray:
+        """
+        which of the (k, 3, 3) fragments frags CENTER, CORNER or SIDE (by
+        name) yields, i.e. that meet every neighbor constraint of its plan
+        """
+        plan, layout = self.PLANS[name]
+        flat = np.asarray(frags).reshape(-1, 9)
+        # column of each _yield argument in the flattened fragment
+        cell = {layout[j]: p for p, j in enumerate((0, 3, 6, 1, 4, 7, 2, 5, 8))}
+        ok = np.ones(len(flat), dtype=bool)
+        for v, rules in plan:
+            for u, d in rules:
+                ok &= self.tid.compat[flat[:, cell[u]], d, flat[:, cell[v]]]
+        return ok
+
+    def _batched(self, frags, batch):
+        while chunk := list(islice(frags, batch)):
+            yield chunk
+
+    def _dump_all(self, f, name: str, batch=1024):
         """
         abstracted helper function for dumping fragment members
 
-        f       {center_fragment, corner_fragment, side_fragment}
+        f       batches of fragments of a tile, i -> iterable of lists or (k, 3, 3) arrays
         name    name of the procedure, names the output directory and prints for debug purposes
+        batch   number of fragments rendered together
         """
         print(name)
         if exists(name):
             rmtree(name)
         mkdir(name)
-        for i in tqdm(range(self.tid.n)):
-            local = f"{name}/{i}"
-            mkdir(local)
-            for n, frag in enumerate(f(i)):
-                self.tid.to_image(frag).save(f"{local}/{n}.png")
+        with ImageWriter() as writer:
+            for i in tqdm(range(self.tid.n)):
+                local = f"{name}/{i}"
+                mkdir(local)
+                n = 0
+                for chunk in f(i, batch):
+                    writer.submit(self._save_batch, chunk, local, n)
+                    n += len(chunk)
+
+    def _save_batch(self, chunk, path: str, start: int):
+        """render a batch of fragments and save them as path/{start + k}.png"""
+        for n, img in enumerate(self.tid.to_images(chunk), start=start):
+            img.save(f"{path}/{n}.png")
 
     def dump_all_center_fragment(self):
-        self._dump_all(self.CENTER, "Center Fragments")
+        self._dump_all(lambda i, batch: self.bulk("CENTER", i, batch), "Center Fragments")
 
     def dump_all_corner_fragment(self):
-        self._dump_all(self.CORNER, "Corner Fragments")
+        self._dump_all(lambda i, batch: self.bulk("CORNER", i, batch), "Corner Fragments")
 
     def dump_all_side_fragment(self):
-        self._dump_all(self.SIDE, "Side Fragments")
+        self._dump_all(lambda i, batch: self.bulk("SIDE", i, batch), "Side Fragments")
 
     def dump_all_center_core(self):
-        self._dump_all(self._core, "Center Core")
+        self._dump_all(lambda i, batch: self._batched(self._core(i), batch), "Center Core")
 
 
 class Store:
     """
-    A collection of fragments
+    A collection of distinct fragments, kept as an (N, 3, 3) int16 array
+    and indexed by their edge strips
+
+    edge 0  frag[0]
+    edge 2  frag[2]
+    edge 1  [frag[0][0], frag[1][0], frag[2][0]]
+    edge 3  [frag[0][2], frag[1][2], frag[2][2]]
+
+    origin[k] flags the algorithms that produced fragment k.
+    With a path the store is saved there on first build and memory mapped
+    from it afterwards, it is rebuilt if the path was saved for another TIS.
+    A path that exists and is neither empty nor a store raises FileExistsError.
     """
 
-    def __init__(self, tis: TIS):
-        self.store = []
-        fragment = Fragment(tis)
-        for i in range(tis.n):
-            for frag in chain(fragment.CENTER(i), fragment.CORNER(i), fragment.SIDE(i)):
-                self.store.append(frag)
+    # origin flags
+    CENTER, CORNER, SIDE = 1, 2, 4
+    # pairs of edges that share a corner
+    CORNERS = ((0, 1), (1, 2), (2, 3), (0, 3))
+
+    def __init__(self, tis: TIS, path: str | None = None):
+        self.tis = tis
+        assert tis.n ** 6 < 2 ** 63, "corner keys do not fit in int64"
+        if path is not None and exists(path) and self._matches(path):
+            self._load(path)
+            return
+        if path is not None:
+            self._check_path(path)
+        self._build()
+        self._setup_index()
+        if path is not None:
+            self.save(path)
+
+    def _build(self):
+        """
+        Enumerate every fragment of every tile without duplicates.
+        Each algorithm yields every fragment meeting its constraints once,
+        so a fragment is new unless an earlier algorithm's constraints hold.
+        """
+        fragment = Fragment(self.tis)
+        algorithms = ((self.CENTER, "CENTER"), (self.CORNER, "CORNER"), (self.SIDE, "SIDE"))
+        blocks, origins = [], []
+        for k, (flag, name) in enumerate(algorithms):
+            for chunk in fragment.bulk(name):
+                seen = np.zeros(len(chunk), dtype=bool)
+                for _, other in algorithms[:k]:
+                    seen |= fragment.satisfies(other, chunk)
+                chunk = chunk[~seen]
+                origin = np.full(len(chunk), flag, dtype=np.uint8)
+                for later, other in algorithms[k + 1 :]:
+                    origin[fragment.satisfies(other, chunk)] |= later
+                blocks.append(chunk)
+                origins.append(origin)
+        self.store = np.concatenate([np.empty((0, 3, 3), np.int16), *blocks])
+        self.origin = np.concatenate([np.empty(0, np.uint8), *origins])
+
+    def _signature(self):
+        """what a saved store is checked against, the TIS it was built from"""
+        digest = sha256(np.packbits(self.tis.compat).tobytes()).hexdigest()
+        return {"n": self.tis.n, "compat": digest}
+
+    def _matches(self, path):
+        fname = f"{path}/tis.json"
+        if not exists(fname):
+            return False
+        with open(fname, "r") as f:
+            return json.load(f) == self._signature()
+
+    def _setup_index(self):
+        """
+        Build the edge indexes, the strip keys of each edge (and each corner)
+        sorted, together with the fragment positions they belong to.
+        """
+        strips = [self.strips(e) for e in range(4)]
+        self.index = {}
+        for e in range(4):
+            self.index[e] = self._sorted(self._key(strips[e]))
+        for a, b in self.CORNERS:
+            self.index[a, b] = self._sorted(self._key(np.concatenate((strips[a], strips[b]), axis=1)))
+
+    @staticmethod
+    def _sorted(keys):
+        order = np.argsort(keys, kind="stable")
+        return keys[order], order
+
+    def _key(self, strips):
+        """Pack strips (..., k) of tile ids into int64 keys. """
+        key = np.zeros(strips.shape[:-1], dtype=np.int64)
+        for j in range(strips.shape[-1]):
+            key = key * self.tis.n + strips[..., j]
+        return key
+
+    def _lookup(self, index, strip):
+        keys, order = self.index[index]
+        key = self._key(np.asarray(strip, dtype=np.int64))
+        lo, hi = np.searchsorted(keys, key, "left"), np.searchsorted(keys, key, "right")
+        for k in order[lo:hi]:
+            yield self.store[k]
+
+    def _files(self, path):
+        files = {"store": f"{path}/store.npy", "origin": f"{path}/origin.npy"}
+        for name in chain(range(4), self.CORNERS):
+            tag = "".join(map(str, name)) if isinstance(name, tuple) else str(name)
+            files[name] = (f"{path}/keys{tag}.npy", f"{path}/order{tag}.npy")
+        return files
+
+    def save(self, path: str):
+        """
+        Save the fragments and their indexes to the directory path, a store
+        saved there before is replaced, any other non empty directory raises
+        FileExistsError.
+        """
+        self._check_path(path)
+        if exists(path):
+            rmtree(path)
+        mkdir(path)
+        files = self._files(path)
+        with open(f"{path}/tis.json", "w") as f:
+            json.dump(self._signature(), f)
+        np.save(files.pop("store"), self.store)
+        np.save(files.pop("origin"), self.origin)
+        for name, (keys, order) in files.items():
+            np.save(keys, self.index[name][0])
+            np.save(order, self.index[name][1])
+
+    @staticmethod
+    def _check_path(path: str):
+        """refuse to overwrite a directory that is neither empty nor a store"""
+        if exists(path) and not exists(f"{path}/tis.json") and listdir(path):
+            raise FileExistsError(f"{path} is not empty and does not hold a store")
+
+    def _load(self, path: str):
+        """Memory map a store saved with save. """
+        files = self._files(path)
+        self.store = np.load(files.pop("store"), mmap_mode="r")
+        self.origin = np.load(files.pop("origin"), mmap_mode="r")
+        self.index = {
+            name: (np.load(keys, mmap_mode="r"), np.load(order, mmap_mode="r"))
+            for name, (keys, order) in files.items()
+        }
+
+    def __len__(self):
+        return len(self.store)
+
+    def strips(self, edge: int):
+        """the (N, 3) strips of every fragment along edge"""
+        return self.strips_of(self.store, edge)
+
+    @staticmethod
+    def strips_of(frags, edge: int):
+        """the (k, 3) strips of the (k, 3, 3) fragments frags along edge"""
+        match edge:
+            case 0:
+                return frags[:, 0, :]
+            case 2:
+                return frags[:, 2, :]
+            case 1:
+                return frags[:, :, 0]
+            case 3:
+                return frags[:, :, 2]
+
+    def query(self, strip: list[int], edge: int):
+        assert 0 <= edge < 4
+        assert len(strip) == 3
+        return self._lookup(edge, strip)
+
+    def query_corner(self, strip_a: list[int], edge_a: int, strip_b: list[int], edge_b: int):
+        """fragments matching strip_a along edge_a and strip_b along edge_b, two adjacent edges"""
+        assert len(strip_a) == 3 and len(strip_b) == 3
+        if (edge_a, edge_b) not in self.CORNERS:
+            strip_a, edge_a, strip_b, edge_b = strip_b, edge_b, strip_a, edge_a
+        assert (edge_a, edge_b) in self.CORNERS
+        return self._lookup((edge_a, edge_b), list(strip_a) + list(strip_b))
+
+
+class LazyStore:
+    """
+    Fragment store generating the fragments of a tile on first demand.
+
+    Fragment arrays are kept per (algorithm, tile) in an LRU cache bounded
+    by `size` bytes, prefetch() generates tiles on a background thread.
+    Queries only read CENTER fragments, with a symmetric neighbor function
+    CENTER(t) already holds every consistent 3x3 fragment with t in the
+    middle, so the tiles to look at are the ones that may sit next to the
+    middle of the queried strip, prefetching the next `ahead` of them.
+    """
+
+    # direction from the middle tile to the middle of the strip on each edge
+    TOWARDS = (2, 1, 0, 3)
+
+    def __init__(self, tis: TIS, size: int = 2 ** 28, ahead: int = 2):
+        # v in nids(u, d) iff u in nids(v, d + 2)
+        mirrored = tis.compat[:, [2, 3, 0, 1], :].transpose(2, 1, 0)
+        assert np.array_equal(tis.compat, mirrored), "LazyStore needs a symmetric TIS, use Store"
+        self.tis = tis
+        self.size = size
+        self.ahead = ahead
+        self.nbytes = 0
+        self._fragment = Fragment(tis)
+        self._algorithms = {Store.CENTER: "CENTER", Store.CORNER: "CORNER", Store.SIDE: "SIDE"}
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(1)
+        # middles[d][u], tiles that accept u in direction d
+        self.middles = [
+            [[t for t in range(tis.n) if tis.mask(t, d) >> u & 1] for u in range(tis.n)]
+            for d in range(4)
+        ]
+
+    def fragments(self, t: int, algorithm: int = Store.CENTER) -> np.ndarray:
+        """the (k, 3, 3) fragments of tile t produced by algorithm"""
+        assert 0 <= t < self.tis.n
+        key = algorithm, t
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            future = self._pending.get(key)
+        if future is not None:
+            return future.result()
+        return self._generate(key)
+
+    def _generate(self, key):
+        algorithm, t = key
+        frags = self._fragment.array(self._algorithms[algorithm], t)
+        with self._lock:
+            self._pending.pop(key, None)
+            if key not in self._cache:
+                self._cache[key] = frags
+                self.nbytes += frags.nbytes
+            while self.nbytes > self.size and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return frags
+
+    def prefetch(self, tiles, algorithm: int = Store.CENTER):
+        """Generate the fragments of tiles on the background thread. """
+        with self._lock:
+            for t in tiles:
+                key = algorithm, t
+                if key not in self._cache and key not in self._pending:
+                    self._pending[key] = self._pool.submit(self._generate, key)
+
+    def _lookup(self, middles, edges, strips):
+        middles = list(middles)
+        for k, t in enumerate(middles):
+            self.prefetch(middles[k + 1 : k + 1 + self.ahead])
+            frags = self.fragments(t)
+            hit = np.ones(len(frags), dtype=bool)
+            for edge, strip in zip(edges, strips):
+                hit &= (Store.strips_of(frags, edge) == strip).all(axis=1)
+            yield from frags[hit]
 
     def query(self, strip: list[int], edge: int):
         assert 0 <= edge < 4
         assert len(strip) == 3
-        for frag in self.store:
-            match edge:
-                case 0:
-                    if frag[0] == strip:
-                        yield frag
-                case 2:
-                    if frag[2] == strip:
-                        yield frag
-                case 1:
-                    if [frag[0][0], frag[1][0], frag[2][0]] == strip:
-                        yield frag
-                case 3:
-                    if [frag[0][2], frag[1][2], frag[2][2]] == strip:
-                        yield frag
+        return self._lookup(self.middles[self.TOWARDS[edge]][strip[1]], [edge], [strip])
+
+    def query_corner(self, strip_a: list[int], edge_a: int, strip_b: list[int], edge_b: int):
+        """fragments matching strip_a along edge_a and strip_b along edge_b, two adjacent edges"""
+        assert len(strip_a) == 3 and len(strip_b) == 3
+        assert (edge_a, edge_b) in Store.CORNERS or (edge_b, edge_a) in Store.CORNERS
+        b = set(self.middles[self.TOWARDS[edge_b]][strip_b[1]])
+        middles = [t for t in self.middles[self.TOWARDS[edge_a]][strip_a[1]] if t in b]
+        return self._lookup(middles, [edge_a, edge_b], [strip_a, strip_b])
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 class Expander:
@@ -199,8 +644,8 @@ class Expander:
         out = [None] * 3
         for a in self.tis.nids(strip[1], 0):
             out[1] = a
-            B = set(self.tis.nids(strip[0], 0)).intersection(set(self.tis.nids(a, 1)))
-            C = set(self.tis.nids(strip[2], 0)).intersection(set(self.tis.nids(a, 3)))
+            B = self.tis.intersect(strip[0], 0, a, 1)
+            C = self.tis.intersect(strip[2], 0, a, 3)
             for b, c in zip(B, C):
                 out[0] = b
                 out[2] = c
@@ -217,12 +662,10 @@ class Expander:
         out = [None] * 3
         for a in self.tis.nids(strip[0], 0):
             out[0] = a
-            B = set(self.tis.nids(strip[1], 0)).intersection(set(self.tis.nids(a, 3)))
+            B = self.tis.intersect(strip[1], 0, a, 3)
             for b in B:
                 out[1] = b
-                C = set(self.tis.nids(strip[2], 0)).intersection(
-                    set(self.tis.nids(b, 3))
-                )
+                C = self.tis.intersect(strip[2], 0, b, 3)
                 for c in C:
                     out[2] = c
                     yield out
@@ -231,12 +674,10 @@ class Expander:
         out = [None] * 3
         for a in self.tis.nids(strip[2], 0):
             out[2] = a
-            B = set(self.tis.nids(strip[1], 0)).intersection(set(self.tis.nids(a, 1)))
+            B = self.tis.intersect(strip[1], 0, a, 1)
             for b in B:
                 out[1] = b
-                C = set(self.tis.nids(strip[0], 0)).intersection(
-                    set(self.tis.nids(b, 1))
-                )
+                C = self.tis.intersect(strip[0], 0, b, 1)
                 for c in C:
                     out[0] = c
                     yield out
@@ -1,5 +1,3 @@
-from copy import deepcopy
-
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
@@ -36,7 +34,7 @@ class MutateEvolve:
     def cull(self):
         """Drop the unfit half of the population. """
         n = self.pop // 2
-        sortable = [(i.fitness(self.tis), i) for i in self.population]
+        sortable = [(i.fitness(), i) for i in self.population]
         ordered = sorted(sortable, key=lambda x:x[0])
         fit = [i[1] for i in ordered]
         self.population = fit[0:n]
@@ -48,11 +46,11 @@ class MutateEvolve:
         """
         new = []
         for i in self.population:
-            fork = deepcopy(i)
+            fork = i.clone()
             if improve:
-                fork.mutate_improve(self.tis)
+                fork.mutate_improve()
             else:
-                fork.mutate(self.tis)
+                fork.mutate()
             new.append(fork)
         self.population += new
 
@@ -91,6 +89,6 @@ class MutateEvolve:
     def _avg_fitness(self) -> float:
         score = 0
         for i in self.population:
-            score += i.fitness(self.tis)
+            score += i.fitness()
         return score / len(self.population)
 
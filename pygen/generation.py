@@ -1,20 +1,56 @@
-from pygen.util import TIS
+from pygen.util import ImageWriter, TIS
+import json
 from itertools import product
-from copy import deepcopy
+from heapq import nlargest
+from math import log2
 from collections import deque
-from os import mkdir
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from hashlib import sha256
+from os import mkdir, remove, replace
 from os.path import exists
+from random import choice, shuffle
 from shutil import rmtree
+import sys
+from time import monotonic
+import warnings
 import matplotlib.pyplot as plt
+import numpy as np
+
+try:
+    from resource import RUSAGE_SELF, getrusage
+except ImportError:  # not available on Windows
+    getrusage = None
 
 
 class Image:
+    """
+    An image being collapsed, each cell holds its domain as a bitmask of
+    tile ids (see TIS.mask). A cell with one bit set is collapsed, a cell
+    with no bits set is a contradiction.
+    """
     def __init__(self, n: int, m: int, tis: TIS):
         self.n = n
         self.m = m
         self.tis = tis
+        # Metrics of the search the image belongs to, counts arc revisions
+        self.metrics = None
+
+        self.img = np.full((n, m), tis.full, dtype=object)
+        # undo trail of (x, y, previous value), only recorded when not None
+        self.trail = None
 
-        self.img = [[set(range(tis.n)) for _ in range(m)] for _ in range(n)]
+        # entropy index, _buckets[e] holds the open cells with e candidates
+        # and _low is a lower bound on the smallest non empty bucket
+        self._buckets = [set() for _ in range(tis.n + 1)]
+        self._open = 0  # cells with more than one candidate
+        self._dead = 0  # cells with no candidate
+        e = TIS.count(tis.full)
+        if e > 1:
+            self._buckets[e].update(self._indicies())
+            self._open = n * m
+        elif e == 0:
+            self._dead = n * m
+        self._low = e
 
     def _indicies(self):
         return product(range(self.n), range(self.m))
@@ -24,118 +60,711 @@ class Image:
         return True if the image is fully collapsed
         False otherwise
         """
-        for h, k in self._indicies():
-            t = self.img[h][k]
-            if isinstance(t, set):
-                return False
-        return True
+        return self._open == 0
     def good(self) -> bool:
         """
         return True if the image is fully collapsed and defined
-        i.e. contains no None
+        i.e. contains no contradiction
         False otherwise
         """
-        if self.complete():
-            for h, k in self._indicies():
-                if self.img[h][k] is None:
-                    return False
-        return True
+        return self._open == 0 and self._dead == 0
+
+    def min_entropy(self, rand=False) -> tuple[int, int]:
+        """
+        A cell with the fewest candidates left, (-1, -1) if there is none.
+        rand    break ties uniformly at random
+        """
+        if self._open == 0:
+            return -1, -1
+        while not self._buckets[self._low]:
+            self._low += 1
+        if rand:
+            return choice(tuple(self._buckets[self._low]))
+        return next(iter(self._buckets[self._low]))
+
+    def entropy(self) -> float:
+        """Total remaining entropy, the sum of log2 of the open cells' domain sizes. """
+        return sum(len(b) * log2(e) for e, b in enumerate(self._buckets) if b)
 
-    def min_entropy(self) -> tuple[int, int]:
-        e = None
-        x, y = -1, -1
-        for h, k in self._indicies():
-            s = self.img[h][k]
-            if isinstance(s, set) and (e is None or len(s) < e):
-                e = len(s)
-                x, y = h, k
-        return x, y
+    def domain(self, x: int, y: int) -> list[int]:
+        """The tile ids (x, y) can still take. """
+        return TIS.ids(self.img[x, y])
 
     def __getitem__(self, x):
-        # if it is desireable to have advanced control
-        # over the object returned here when using self[x]
-        # notation a special data type must be defined for
-        # the columns
-        return self.img[x]
+        """
+        Column x with each cell decoded from its bitmask, the tile id of a
+        collapsed cell, None for a contradiction and the set of candidates
+        otherwise. self.img holds the raw bitmasks.
+        """
+        return [self._decode(d) for d in self.img[x]]
+
+    @staticmethod
+    def _decode(d):
+        match TIS.count(d):
+            case 0:
+                return None
+            case 1:
+                return TIS.ids(d)[0]
+            case _:
+                return set(TIS.ids(d))
 
     def neighbors(self, x, y):
-        if x < self.n - 1 and isinstance(self.img[x + 1][y], set):
+        if x < self.n - 1:
             yield 0, x + 1, y
-        if y < self.m - 1 and isinstance(self.img[x][y + 1], set):
+        if y < self.m - 1:
             yield 3, x, y + 1
-        if x > 0 and isinstance(self.img[x - 1][y], set):
+        if x > 0:
             yield 2, x - 1, y
-        if y > 0 and isinstance(self.img[x][y - 1], set):
+        if y > 0:
             yield 1, x, y - 1
 
-    def collapse(self, h: int, k: int, t: int):
-        if t in self.img[h][k]:
-            self.img[h][k] = t
-            for nid, i, j in self.neighbors(h, k):
-                T = self.img[i][j].intersection(set(self.tis(t, nid)))
-                if len(T) > 0:
-                    self.img[i][j] = T
-                else:
-                    self.img[i][j] = None
+    def collapse(self, h: int, k: int, t: int) -> bool:
+        """
+        Collapse (h, k) to t and propagate,
+        return False if the image can no longer be completed.
+        """
+        b = 1 << t
+        if not self.img[h, k] & b:
+            return False
+        if self.img[h, k] != b:
+            self._assign(h, k, b)
+        return self.propagate([(h, k)])
+
+    def propagate(self, cells=None) -> bool:
+        """
+        Arc consistency (AC-3) from the changed cells (default all cells)
+        to a fixpoint, every value left in a domain is supported by each
+        neighboring domain. Return False on a contradiction.
+        """
+        if self._dead:
+            return False
+        work = list(self._indicies() if cells is None else cells)
+        pending = set(work)
+        metrics = self.metrics
+        while work:
+            x, y = work.pop()
+            pending.discard((x, y))
+            d = self.img[x, y]
+            for nid, i, j in self.neighbors(x, y):
+                if metrics is not None:
+                    metrics.revisions += 1
+                old = self.img[i, j]
+                new = old & self.tis.support(d, nid)
+                if new != old:
+                    self._assign(i, j, new)
+                    if new == 0:
+                        return False
+                    if (i, j) not in pending:
+                        pending.add((i, j))
+                        work.append((i, j))
+        return True
+
+    def fix(self, seed) -> None:
+        """
+        Restrict the image to a partial id matrix (indexed [x][y], None for
+        free cells), call propagate() afterwards.
+        """
+        assert len(seed) == self.n and all(len(col) == self.m for col in seed)
+        for x, y in self._indicies():
+            if (t := seed[x][y]) is not None:
+                self._assign(x, y, self.img[x, y] & (1 << t))
+
+    def _assign(self, x: int, y: int, v):
+        if self.trail is not None:
+            self.trail.append((x, y, self.img[x, y]))
+        self._set(x, y, v)
+
+    def _set(self, x: int, y: int, v):
+        """Set the domain of (x, y) and keep the entropy index up to date. """
+        old = TIS.count(self.img[x, y])
+        new = TIS.count(v)
+        self.img[x, y] = v
+        if old == new:
+            return
+        if old > 1:
+            self._buckets[old].discard((x, y))
+            self._open -= 1
+        elif old == 0:
+            self._dead -= 1
+        if new > 1:
+            self._buckets[new].add((x, y))
+            self._open += 1
+            self._low = min(self._low, new)
+        elif new == 0:
+            self._dead += 1
+
+    def mark(self) -> int:
+        """Start recording changes (if not already) and return the current trail position. """
+        if self.trail is None:
+            self.trail = []
+        return len(self.trail)
+
+    def undo(self, mark: int):
+        """Revert every change recorded after mark. """
+        while len(self.trail) > mark:
+            x, y, v = self.trail.pop()
+            self._set(x, y, v)
 
     def copy(self):
-        return deepcopy(self)
+        fork = Image.__new__(Image)
+        fork.n = self.n
+        fork.m = self.m
+        fork.tis = self.tis
+        fork.metrics = self.metrics
+        fork.img = self.img.copy()
+        fork.trail = None
+        fork._buckets = [b.copy() for b in self._buckets]
+        fork._open = self._open
+        fork._dead = self._dead
+        fork._low = self._low
+        return fork
+
+    def to_bytes(self) -> bytes:
+        """The domains as ceil(n / 8) little endian bytes per cell, in [x][y] order. """
+        nb = (self.tis.n + 7) // 8
+        return b"".join(int(d).to_bytes(nb, "little") for d in self.img.flat)
+
+    @classmethod
+    def from_bytes(cls, raw: bytes, n: int, m: int, tis: TIS):
+        """Rebuild an image from to_bytes(). """
+        nb = (tis.n + 7) // 8
+        img = cls(n, m, tis)
+        for k, (x, y) in enumerate(img._indicies()):
+            img._set(x, y, int.from_bytes(raw[k * nb:(k + 1) * nb], "little"))
+        return img
 
     def to_image(self):
-        return self.tis.to_image(self.img)
+        ids = [[TIS.ids(d)[0] if TIS.count(d) == 1 else None for d in col] for col in self.img]
+        return self.tis.to_image(ids)
 
 
-def generate(n: int, m: int, tis: TIS, verbose:bool, log:bool):
-    active = deque()
-    active.append(Image(n, m, tis))
-    if log:
-        pop_history = []
-        img_done = []  # a list of time steps when images terminated
-        _time_step = 0
-    if verbose:
-        i = 0
-        ith = 0
-    while len(active) > 0:
-        if verbose:
-            if i % 1000 == 0:
-                print(len(active))
-            i += 1
-        if log:
-            pop_history.append(len(active))
-        img = active.popleft()
-        x, y = img.min_entropy()
-        for t in img[x][y]:
-            fork = img.copy()
-            fork.collapse(x, y, t)
-            if fork.complete():
-                if log:
-                    img_done.append(_time_step)
-                if verbose:
-                    print(f'{ith}.png')
-                    ith += 1
-                yield fork
+class Metrics:
+    """
+    Search instrumentation for generate. Counters are updated as the search
+    runs and every `every` expanded nodes a sample of them is written to out
+    as a JSON line (fmt="jsonl") or CSV row (fmt="csv"):
+    t               seconds since the search started
+    nodes           nodes expanded (collapses attempted)
+    contradictions  collapses that left a cell without candidates
+    revisions       arc revisions performed by propagating the search's images
+    frontier        open images (breadth first) or stack depth (depth first)
+    solutions       complete images yielded
+    solutions_per_sec
+    peak_memory     peak resident set size in kilobytes (None where the
+                    resource module is missing, i.e. Windows)
+    With keep=True the samples are also kept in self.samples (for plot()).
+    """
+    FIELDS = (
+        "t", "nodes", "contradictions", "revisions", "frontier",
+        "solutions", "solutions_per_sec", "peak_memory",
+    )
+
+    def __init__(self, out=None, every=1000, fmt="jsonl", keep=False):
+        assert fmt in ("jsonl", "csv")
+        self.out = out
+        self.every = every
+        self.fmt = fmt
+        self.keep = keep
+        self.samples = []
+        self.nodes = 0
+        self.contradictions = 0
+        self.solutions = 0
+        self.frontier = 0
+        self.revisions = 0
+        self._start = monotonic()
+        if out is not None and fmt == "csv":
+            out.write(",".join(self.FIELDS) + "\n")
+
+    def node(self, frontier: int, consistent: bool):
+        """Record an expanded node. """
+        self.nodes += 1
+        self.frontier = frontier
+        if not consistent:
+            self.contradictions += 1
+        if self.nodes % self.every == 0:
+            self.sample()
+
+    def solution(self):
+        self.solutions += 1
+
+    def sample(self) -> dict:
+        """Take (and emit) a sample of the counters. """
+        t = monotonic() - self._start
+        row = {
+            "t": round(t, 6),
+            "nodes": self.nodes,
+            "contradictions": self.contradictions,
+            "revisions": self.revisions,
+            "frontier": self.frontier,
+            "solutions": self.solutions,
+            "solutions_per_sec": self.solutions / t if t > 0 else 0.0,
+            "peak_memory": _peak_memory(),
+        }
+        if self.keep:
+            self.samples.append(row)
+        if self.out is not None:
+            if self.fmt == "jsonl":
+                self.out.write(json.dumps(row) + "\n")
             else:
-                active.append(fork)
-        if log:
-            _time_step += 1
-    if log:
-        plt.plot(pop_history)
-        plt.vlines(img_done, 0, max(pop_history) * 0.25, colors='r')
+                self.out.write(",".join(str(row[f]) for f in self.FIELDS) + "\n")
+        return row
+
+    def close(self):
+        """Emit a final sample. """
+        self.sample()
+        if self.out is not None:
+            self.out.flush()
+
+    def plot(self, title: str, fname: str):
+        """Plot the sampled frontier size, red lines mark samples with new solutions. """
+        nodes = [r["nodes"] for r in self.samples]
+        frontier = [r["frontier"] for r in self.samples]
+        found = [
+            b["nodes"] for a, b in zip(self.samples, self.samples[1:])
+            if b["solutions"] > a["solutions"]
+        ]
+        plt.plot(nodes, frontier)
+        plt.vlines(found, 0, max(frontier, default=0) * 0.25, colors='r')
         plt.ylabel('# of possible images being collapsed')
-        plt.xlabel('t')
-        plt.title(f'{n}x{m} Population over lifetime of Generation algorithm')
-        plt.savefig(f'{n}x{m} population plot.png')
+        plt.xlabel('nodes')
+        plt.title(title)
+        plt.savefig(fname)
+        plt.clf()
 
 
-def sudoku_dump(n: int, m: int, tis: TIS, path: str, verbose=False, log=False, partial=False):
-    if exists(path):
-        rmtree(path)
-    mkdir(path)
+def _peak_memory() -> int | None:
+    """Peak resident set size of this process in kilobytes. """
+    if getrusage is None:
+        return None
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def generate(n: int, m: int, tis: TIS, verbose=False, log=False, depth_first=False, seed=None, checkpoint=None, every=10000, metrics=None, on_checkpoint=None):
+    """
+    Yield every image the constrained search can complete, each exactly once.
+    Every expansion splits an image on the values of a single cell, so no
+    two subtrees (or frontier entries) ever hold the same state.
+    verbose         print Metrics samples to stdout every 1000 nodes
+    log             plot the sampled frontier size to '{n}x{m} population plot.png'
+    depth_first     explore depth first, collapsing one image in place and
+                    backtracking through its undo trail, memory is bounded
+                    by cells * depth instead of the size of the frontier
+    seed            partial id matrix (indexed [x][y], None for free cells)
+                    the search starts from, propagated before searching
+    checkpoint      file the search frontier is saved to every `every` steps,
+                    if it exists the search resumes from it instead of
+                    starting over, it is removed once the search is done.
+                    A checkpoint of a search with another n, m, tis or seed
+                    raises ValueError
+    metrics         Metrics instance to record the search in
+    on_checkpoint   called before each checkpoint is saved, e.g. to make
+                    sure the images yielded so far are stored
+    """
+    if metrics is None and (verbose or log):
+        metrics = Metrics(sys.stdout if verbose else None, keep=log)
+    if checkpoint is not None and exists(checkpoint):
+        count, roots = load_frontier(checkpoint, n, m, tis, seed)
+    else:
+        img = Image(n, m, tis)
+        if seed is not None:
+            img.fix(seed)
+        count, roots = 0, [img]
+    for img in roots:
+        img.metrics = metrics
+
+    # prune values that can never be placed before searching
+    frontier = deque()
+    for img in roots:
+        if not img.propagate():
+            continue
+        if img.complete():
+            count += 1
+            if metrics is not None:
+                metrics.solution()
+            yield img
+        else:
+            frontier.append(img)
+
+    step = 0
+    if depth_first:
+        # each frame is (x, y, remaining choices, trail mark)
+        stack = []
+        while len(stack) > 0 or len(frontier) > 0:
+            if checkpoint is not None and step % every == 0:
+                if on_checkpoint is not None:
+                    on_checkpoint()
+                save_frontier(checkpoint, _unwind(img, stack) + list(frontier), count, n, m, tis, seed)
+            step += 1
+            if len(stack) == 0:
+                img = frontier.popleft()
+                stack.append(_branch(img))
+            x, y, choices, mark = stack[-1]
+            img.undo(mark)
+            if len(choices) == 0:
+                stack.pop()
+                continue
+            consistent = img.collapse(x, y, choices.pop())
+            if metrics is not None:
+                metrics.node(len(stack), consistent)
+            if consistent:
+                if img.complete():
+                    count += 1
+                    if metrics is not None:
+                        metrics.solution()
+                    yield img.copy()
+                else:
+                    stack.append(_branch(img))
+    else:
+        active = frontier
+        while len(active) > 0:
+            if checkpoint is not None and step % every == 0:
+                if on_checkpoint is not None:
+                    on_checkpoint()
+                save_frontier(checkpoint, list(active), count, n, m, tis, seed)
+            step += 1
+            img = active.popleft()
+            x, y = img.min_entropy()
+            for t in img.domain(x, y):
+                fork = img.copy()
+                consistent = fork.collapse(x, y, t)
+                if metrics is not None:
+                    metrics.node(len(active), consistent)
+                if not consistent:
+                    continue
+                if fork.complete():
+                    count += 1
+                    if metrics is not None:
+                        metrics.solution()
+                    yield fork
+                else:
+                    active.append(fork)
+    if checkpoint is not None and exists(checkpoint):
+        remove(checkpoint)
+    if metrics is not None:
+        metrics.close()
+        if log:
+            metrics.plot(
+                f'{n}x{m} Population over lifetime of Generation algorithm',
+                f'{n}x{m} population plot.png',
+            )
+
+
+def _branch(img: Image, rand=False):
+    """Depth first search frame for the next cell to collapse in img. """
+    x, y = img.min_entropy(rand)
+    choices = img.domain(x, y)[::-1]
+    if rand:
+        shuffle(choices)
+    return x, y, choices, img.mark()
+
+
+def _unwind(img: Image, stack: list) -> list[Image]:
+    """
+    The open subproblems of a depth first search as images, in the order
+    the search would visit them, img is left untouched.
+    """
+    out = []
+    if len(stack) == 0:
+        return out
+    snap = img.copy()
+    snap.trail = list(img.trail)
+    for x, y, choices, mark in reversed(stack):
+        snap.undo(mark)
+        if len(choices) > 0:
+            sub = snap.copy()
+            mask = 0
+            for t in choices:
+                mask |= 1 << t
+            sub._set(x, y, mask)
+            out.append(sub)
+    return out
+
+
+def sample(n: int, m: int, tis: TIS, seed=None, budget=None, backtracks=64, cancel=None) -> Image | None:
+    """
+    Las Vegas search for a single image, depth first with random min
+    entropy tie breaks and random value order. A run that backtracks more
+    than `backtracks` times is restarted with twice the allowance.
+    seed        partial id matrix to complete, as in generate
+    budget      wall clock budget in seconds
+    cancel      cancellation token, any object with is_set() (e.g. threading.Event)
+    Returns the first complete image, or when the budget runs out, cancel is
+    set or no image exists, the partial image with the fewest undecided
+    cells seen (None if the seed itself is contradictory).
+    """
+    deadline = None if budget is None else monotonic() + budget
+    root = Image(n, m, tis)
+    if seed is not None:
+        root.fix(seed)
+    if not root.propagate():
+        return None
+    if root.complete():
+        return root
+    best = root
+    while True:
+        img = root.copy()
+        stack = [_branch(img, rand=True)]
+        fails = 0
+        while len(stack) > 0 and fails <= backtracks:
+            if deadline is not None and monotonic() > deadline:
+                return best
+            if cancel is not None and cancel.is_set():
+                return best
+            x, y, choices, mark = stack[-1]
+            img.undo(mark)
+            if len(choices) == 0:
+                stack.pop()
+                fails += 1
+                continue
+            if img.collapse(x, y, choices.pop()):
+                if img.complete():
+                    return img
+                if img._open < best._open:
+                    best = img.copy()
+                stack.append(_branch(img, rand=True))
+        if len(stack) == 0:
+            # the whole tree was searched without a restart, there is no image
+            return best
+        backtracks *= 2
+
+
+def beam(n: int, m: int, tis: TIS, width: int, seed=None, key=Image.entropy):
+    """
+    Beam search, a breadth first search that keeps at most `width` open
+    images per depth, those with the largest key (by default the remaining
+    entropy, the least constrained images), contradicted images are always
+    dropped. Every complete image produced by expanding the kept images is
+    yielded (complete images never compete for the `width` slots), memory
+    and time are bounded by width * cells * tiles per depth.
+    seed        partial id matrix to complete, as in generate
+    """
+    img = Image(n, m, tis)
+    if seed is not None:
+        img.fix(seed)
+    if not img.propagate():
+        return
+    if img.complete():
+        yield img
+        return
+    frontier = [img]
+    while len(frontier) > 0:
+        expanded = []
+        for img in frontier:
+            x, y = img.min_entropy()
+            for t in img.domain(x, y):
+                fork = img.copy()
+                if not fork.collapse(x, y, t):
+                    continue
+                if fork.complete():
+                    yield fork
+                else:
+                    expanded.append(fork)
+        frontier = nlargest(width, expanded, key=key)
+
+
+def save_frontier(fname: str, frontier: list[Image], count: int, n: int, m: int, tis: TIS, seed=None):
+    """
+    Save the frontier of a search for n x m images of tis from seed and the
+    number of images yielded so far, the file is replaced atomically.
+    """
+    nb = (tis.n + 7) // 8
+    raw = b"".join(img.to_bytes() for img in frontier)
+    domains = np.frombuffer(raw, dtype=np.uint8).reshape(len(frontier), n, m, nb)
+    tmp = f"{fname}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, count=count, domains=domains, **_signature(n, m, tis, seed))
+    replace(tmp, fname)
+
+
+def load_frontier(fname: str, n: int, m: int, tis: TIS, seed=None) -> tuple[int, list[Image]]:
+    """
+    Load a search frontier saved with save_frontier, raise ValueError if it
+    was saved by a search with another n, m, tis or seed.
+    """
+    with np.load(fname) as data:
+        for key, value in _signature(n, m, tis, seed).items():
+            if key not in data or not np.array_equal(data[key], value):
+                raise ValueError(f"checkpoint {fname} belongs to another search ({key} differs)")
+        count = int(data["count"])
+        domains = data["domains"]
+    frontier = []
+    for d in domains:
+        frontier.append(Image.from_bytes(d.tobytes(), n, m, tis))
+    return count, frontier
+
+
+def _signature(n: int, m: int, tis: TIS, seed) -> dict:
+    """What a checkpoint is checked against, the search it was saved by. """
+    digest = sha256(np.packbits(tis.compat).tobytes()).hexdigest()
+    if seed is None:
+        seed = np.empty((0, 0), dtype=np.int64)
+    else:
+        seed = np.array([[-1 if t is None else t for t in col] for col in seed], dtype=np.int64)
+    return {"n": n, "m": m, "tiles": tis.n, "compat": digest, "seed": seed}
+
+
+def checkpoint_count(fname: str) -> int:
+    """Number of images yielded before a checkpoint was saved, 0 without one. """
+    if not exists(fname):
+        return 0
+    with np.load(fname) as data:
+        return int(data["count"])
+
+
+def parallel_generate(n: int, m: int, tis: TIS, processes=None, levels=2, budget=100000, seed=None):
+    """
+    Yield every image the constrained search can complete, searching on a
+    process pool. The first `levels` levels of the search tree are expanded
+    here and each resulting subproblem is searched depth first by a worker,
+    a worker that has not finished its subproblem after `budget` steps hands
+    its open subproblems back to be requeued for idle workers.
+    """
+    yield from _parallel(n, m, tis, processes, levels, budget, seed, None)
+
+
+def _parallel(n, m, tis, processes, levels, budget, seed, path):
+    """
+    Shared driver of parallel_generate and sudoku_dump, with a path the
+    workers save their images as path/{task}-{i}.png and (task, number
+    saved) is yielded instead.
+    """
+    img = Image(n, m, tis)
+    if seed is not None:
+        img.fix(seed)
+    if not img.propagate():
+        return
+    frontier = [img]
+    for _ in range(levels):
+        expanded = []
+        for img in frontier:
+            if img.complete():
+                expanded.append(img)
+                continue
+            x, y = img.min_entropy()
+            for t in img.domain(x, y):
+                fork = img.copy()
+                if fork.collapse(x, y, t):
+                    expanded.append(fork)
+        frontier = expanded
+
+    shared = tis.share()
+    task = 0
+    pool = ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(shared,))
+    finished = False
+    try:
+        pending = {}  # future -> task
+        for img in frontier:
+            pending[pool.submit(_search, img.to_bytes(), n, m, budget, path, task)] = task
+            task += 1
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                found, rest = future.result()
+                if path is None:
+                    for raw in found:
+                        yield Image.from_bytes(raw, n, m, tis)
+                else:
+                    yield pending[future], found
+                del pending[future]
+                for raw in rest:
+                    pending[pool.submit(_search, raw, n, m, budget, path, task)] = task
+                    task += 1
+        finished = True
+    finally:
+        # a consumer that stops early (or an error) must not wait for every
+        # queued subproblem to run out its budget, drop them instead
+        pool.shutdown(wait=finished, cancel_futures=not finished)
+        shared.unlink()
+
+
+_worker_tis = None
+
+
+def _init_worker(tis: TIS):
+    global _worker_tis
+    _worker_tis = tis
+
+
+def _search(raw: bytes, n: int, m: int, budget: int, path, task: int):
+    """
+    Worker side of _parallel, depth first search of one subproblem for at
+    most budget steps. Returns the images found (as bytes, or their number
+    when they are saved to path) and the open subproblems left over.
+    """
+    img = Image.from_bytes(raw, n, m, _worker_tis)
+    found = []
+
+    def emit(img):
+        if path is None:
+            found.append(img.to_bytes())
+        else:
+            img.to_image().save(f"{path}/{task}-{len(found)}.png")
+            found.append(None)
+
+    stack = []
+    if img.propagate():
+        if img.complete():
+            emit(img)
+        else:
+            stack.append(_branch(img))
+    for _ in range(budget):
+        if len(stack) == 0:
+            break
+        x, y, choices, mark = stack[-1]
+        img.undo(mark)
+        if len(choices) == 0:
+            stack.pop()
+            continue
+        if img.collapse(x, y, choices.pop()):
+            if img.complete():
+                emit(img)
+            else:
+                stack.append(_branch(img))
+    rest = [sub.to_bytes() for sub in _unwind(img, stack)]
+    return (found if path is None else len(found)), rest
+
+
+def sudoku_dump(n: int, m: int, tis: TIS, path: str, verbose=False, log=False, partial=False, depth_first=False, seed=None, checkpoint=None, processes=None, levels=2, budget=100000):
+    """
+    Save every generated image to path/{i}.png, when resuming from a
+    checkpoint the existing images are kept and numbering continues.
+    With processes the search runs on a process pool (see parallel_generate
+    for levels and budget), the workers save the images themselves and they
+    are renumbered as they arrive. verbose, log, depth_first and checkpoint
+    do not apply to it and raise ValueError.
+    partial is deprecated and ignored, contradicted branches are pruned
+    by propagation and never reach the dump.
+    """
     if partial:
-        mkdir(f'{path}/partial')
-    for i, img in enumerate(generate(n, m, tis, verbose, log)):
-        out = img.to_image()
-        if img.good():
-            out.save(f"{path}/{i}.png")
-        elif partial:
-            out.save(f"{path}/partial/{i}.png")
+        warnings.warn(
+            "sudoku_dump(partial=True) is deprecated and ignored, "
+            "contradicted images are never generated",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+    if processes is not None:
+        serial = {"verbose": verbose, "log": log, "depth_first": depth_first, "checkpoint": checkpoint}
+        if unsupported := [k for k, v in serial.items() if v not in (False, None)]:
+            raise ValueError(f"sudoku_dump(processes=...) does not support {', '.join(unsupported)}")
+        if exists(path):
+            rmtree(path)
+        mkdir(path)
+        i = 0
+        for task, found in _parallel(n, m, tis, processes, levels, budget, seed, path):
+            for j in range(found):
+                replace(f"{path}/{task}-{j}.png", f"{path}/{i}.png")
+                i += 1
+        return
+    start = 0 if checkpoint is None else checkpoint_count(checkpoint)
+    if start == 0 and exists(path):
+        rmtree(path)
+    if not exists(path):
+        mkdir(path)
+    with ImageWriter() as writer:
+        # the checkpoint's count must not include images still being saved
+        images = generate(n, m, tis, verbose, log, depth_first, seed, checkpoint, on_checkpoint=writer.flush)
+        for i, img in enumerate(images, start=start):
+            if img.good():
+                writer.save(f"{path}/{i}.png", img.to_image)
@@ -0,0 +1,118 @@
+"""
+This module implements exact counting and uniform sampling of complete images
+with a row transfer matrix, for canvases narrow enough to enumerate the
+valid rows (or columns) of.
+"""
+
+from random import randrange
+
+from .util import TIS
+from .generation import Image
+
+
+class RowTransfer:
+    """
+    Transfer matrix over the valid strips of the narrow side of an n x m canvas.
+    A strip is a line of tiles across the narrow side that is consistent with
+    TIS, two strips are joined if they can be placed next to each other.
+    The number of complete images ending at each strip is computed by
+    dynamic programming over the long side.
+    """
+    def __init__(self, n: int, m: int, tis: TIS):
+        self.n = n
+        self.m = m
+        self.tis = tis
+        # strips run along y (columns) across the narrow side, unless the
+        # canvas is taller than wide, then they run along x (rows)
+        self.transposed = n < m
+        if self.transposed:
+            self.length, self.steps = n, m
+            self.along, self.across = 0, 3
+        else:
+            self.length, self.steps = m, n
+            self.along, self.across = 3, 0
+
+        self._setup()
+
+    def _setup(self):
+        """Enumerate the strips, their successors and the completion counts. """
+        # ok[d][u], tiles v that may sit in direction d of u and have u in
+        # their opposite direction
+        tis = self.tis
+        self.ok = [[0] * tis.n for _ in range(4)]
+        for u in range(tis.n):
+            for d in range(4):
+                for v in tis.ids(tis.mask(u, d)):
+                    if tis.mask(v, (d + 2) % 4) >> u & 1:
+                        self.ok[d][u] |= 1 << v
+
+        self.strips = list(self._strips())
+        self.index = {s: i for i, s in enumerate(self.strips)}
+        self.next = [
+            [self.index[s] for s in self._strips(strip)] for strip in self.strips
+        ]
+
+        # ways[k][i], complete images from strip i at step k to the end
+        self.ways = [[1] * len(self.strips)]
+        for _ in range(self.steps - 1):
+            after = self.ways[0]
+            self.ways.insert(0, [sum(after[j] for j in nxt) for nxt in self.next])
+
+    def _strips(self, prev=None):
+        """
+        Iterate the strips, or with prev only those that can follow it.
+        """
+        if self.length == 0:
+            return
+        out = [0] * self.length
+
+        def domain(i):
+            d = self.tis.full if prev is None else self.ok[self.across][prev[i]]
+            if i > 0:
+                d &= self.ok[self.along][out[i - 1]]
+            return d
+
+        stack = [TIS.ids(domain(0))]
+        while stack:
+            i = len(stack) - 1
+            if not stack[-1]:
+                stack.pop()
+                continue
+            out[i] = stack[-1].pop()
+            if i + 1 == self.length:
+                yield tuple(out)
+            else:
+                stack.append(TIS.ids(domain(i + 1)))
+
+    def count(self) -> int:
+        """The exact number of complete n x m images. """
+        if self.steps == 0:
+            return 0
+        return sum(self.ways[0])
+
+    def sample(self) -> Image | None:
+        """Draw a complete image uniformly at random, None if there is none. """
+        total = self.count()
+        if total == 0:
+            return None
+        chosen = []
+        candidates = range(len(self.strips))
+        for k in range(self.steps):
+            r = randrange(sum(self.ways[k][j] for j in candidates))
+            for j in candidates:
+                r -= self.ways[k][j]
+                if r < 0:
+                    break
+            chosen.append(self.strips[j])
+            candidates = self.next[j]
+
+        ids = [[None] * self.m for _ in range(self.n)]
+        for k, strip in enumerate(chosen):
+            for i, t in enumerate(strip):
+                if self.transposed:
+                    ids[i][k] = t
+                else:
+                    ids[k][i] = t
+        img = Image(self.n, self.m, self.tis)
+        img.fix(ids)
+        return img
@@ -1,15 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor, wait
 from itertools import product
 import json
-from os import mkdir
+from os import cpu_count, mkdir
 from os.path import exists
 from random import choice, randint
 from shutil import rmtree
-from copy import deepcopy
+import struct
+from multiprocessing import shared_memory
+from threading import BoundedSemaphore, Lock
+import warnings
 
-from PIL import Image, ImageDraw
+from PIL import GifImagePlugin, Image, ImageDraw
 import numpy as np
 from tqdm import tqdm
 
+# binary TIS layout, every section starts on a 64 byte boundary
+#   header  magic, version, n, width, height
+#   compat  (n, 4, n) uint8, compat[t, d, k] is 1 iff k in nids(t, d)
+#   atlas   (n + 1, height, width, 4) uint8
+_BINARY_MAGIC = b"TISB"
+_BINARY_VERSION = 2
+_BINARY_HEADER = struct.Struct("<4sIIII")
+
+
+def _align(offset: int, to=64) -> int:
+    return -(-offset // to) * to
+
 
 class TIS:
     """
@@ -19,22 +35,277 @@ class TIS:
 
     def __init__(self, path="TIS"):
         self.path = path
-        with open("TIS/TIS.json", "r") as f:
+        with open(f"{path}/TIS.json", "r") as f:
             tid = json.load(f)
             self.n = tid["n"]
             self.width = tid["width"]
             self.height = tid["height"]
             self._setup(tid["neighborhoods"])
 
+    @classmethod
+    def from_image(cls, path, tile_w, tile_h, band=64, max_pixels=None):
+        """
+        Compute TIS directly from a tiled image, equivalent to `tit compute`.
+        PIL decodes the whole sheet, the RGBA copy, tiling, hashing and
+        neighbor extraction are done one band of tile rows at a time.
+        path        path of the source image
+        tile_w      width of the tiles
+        tile_h      height of the tiles
+        band        number of tile rows held as an array at once, the tile
+                    ids do not depend on it
+        max_pixels  refuse sheets larger than this instead of warning about
+                    sheets over Image.MAX_IMAGE_PIXELS, None keeps PIL's
+                    check as is. PIL always refuses sheets over twice
+                    Image.MAX_IMAGE_PIXELS, raise that (process wide) limit
+                    to read larger ones
+        """
+        if max_pixels is None:
+            src = Image.open(path)
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+                src = Image.open(path)
+            if src.width * src.height > max_pixels:
+                src.close()
+                raise ValueError(
+                    f"{path} has {src.width * src.height} pixels, more than max_pixels={max_pixels}"
+                )
+        with src:
+            return cls._from_sheet(src, path, tile_w, tile_h, band)
+
+    @classmethod
+    def _from_sheet(cls, src, path, tile_w, tile_h, band):
+        width, height = src.size
+        cols = width // tile_w
+        rows = height // tile_h
+        if Image.MAX_IMAGE_PIXELS is not None:
+            # keep each band crop below PIL's decompression bomb check
+            band = max(1, min(band, Image.MAX_IMAGE_PIXELS // (tile_h * width)))
+
+        index = {}  # raw tile bytes -> tile id
+        tiles = []
+        pairs = [set() for _ in range(4)]
+        prev = None  # last row of tile ids of the previous band
+        for r0 in range(0, rows, band):
+            r1 = min(r0 + band, rows)
+            box = (0, r0 * tile_h, cols * tile_w, r1 * tile_h)
+            px = np.asarray(src.crop(box).convert("RGBA"))
+            # (rows, cols, tile_h, tile_w, 4), tiles in reading order
+            cells = px.reshape(r1 - r0, tile_h, cols, tile_w, 4).transpose(0, 2, 1, 3, 4)
+            flat = np.ascontiguousarray(cells).reshape((r1 - r0) * cols, -1)
+            keys = flat.view(np.dtype((np.void, flat.shape[1]))).ravel()
+            uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            # number the tiles in order of first appearance reading the sheet
+            # row by row (tit numbers them in HashSet order, so ids may differ
+            # from its TIS by a permutation)
+            local = np.empty(len(uniq), dtype=np.intp)
+            for u in np.argsort(first):
+                key = uniq[u].tobytes()
+                if key not in index:
+                    index[key] = len(tiles)
+                    tiles.append(flat[first[u]].reshape(tile_h, tile_w, 4))
+                local[u] = index[key]
+            # id matrix of the band indexed [x][y]
+            ids = local[inverse.ravel()].reshape(r1 - r0, cols).T
+            if prev is not None:
+                ids = np.concatenate([prev, ids], axis=1)
+            prev = ids[:, -1:]
+
+            # neighbor relations by shifting the id matrix
+            #   _ 1 _
+            #   2 i 0
+            #   _ 3 _
+            for d, a, b in [
+                (0, ids[:-1, :], ids[1:, :]),
+                (1, ids[:, 1:], ids[:, :-1]),
+                (2, ids[1:, :], ids[:-1, :]),
+                (3, ids[:, :-1], ids[:, 1:]),
+            ]:
+                pairs[d].update(np.unique(a.ravel().astype(np.int64) << 32 | b.ravel()).tolist())
+
+        tis = cls.__new__(cls)
+        tis.path = path
+        tis.n = len(tiles)
+        tis.width = tile_w
+        tis.height = tile_h
+        neighbors = [[set() for _ in range(4)] for _ in range(tis.n)]
+        for d, codes in enumerate(pairs):
+            for code in codes:
+                neighbors[code >> 32][d].add(code & 0xFFFFFFFF)
+        tis.mapping = [[sorted(s) for s in hood] for hood in neighbors]
+        tis._setup_masks()
+        tis.tiles = [Image.fromarray(t, "RGBA") for t in tiles]
+        tis._setup_atlas()
+        return tis
+
+    def save(self, path="TIS"):
+        """
+        Save TIS to a directory in the layout written by the tit binary,
+        path/TIS.json and path/tiles/{id}.png
+        """
+        if exists(path):
+            rmtree(path)
+        mkdir(path)
+        mkdir(f"{path}/tiles")
+        for i, tile in enumerate(self.tiles):
+            tile.save(f"{path}/tiles/{i}.png")
+        tid = {
+            "neighborhoods": [{"neighbors": hood} for hood in self.mapping],
+            "n": self.n,
+            "width": self.width,
+            "height": self.height,
+        }
+        with open(f"{path}/TIS.json", "w") as f:
+            json.dump(tid, f)
+
+    @classmethod
+    def from_binary(cls, fname):
+        """
+        Load TIS from a single binary file written by save_binary.
+        The file is memory mapped, compat and the atlas are read only views
+        of it so processes loading the same file share its pages, the
+        bitmasks and neighbor lists are only built when first used.
+        """
+        return cls._from_buffer(np.memmap(fname, dtype=np.uint8, mode="r"), fname)
+
+    def save_binary(self, fname):
+        """
+        Save TIS (metadata, compatibility tensor and tile atlas) to a single
+        binary file, see from_binary.
+        """
+        with open(fname, "wb") as f:
+            f.write(self._to_bytes())
+
+    def share(self):
+        """
+        Publish TIS into shared memory and return a TIS backed by it.
+        The returned TIS pickles as the name of its shared memory block, so
+        handing it (or an Individual holding it) to a process pool worker
+        attaches to the same pages instead of copying the atlas and compat.
+        The owner must call unlink() once the workers are done.
+        """
+        data = self._to_bytes()
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        shm.buf[: len(data)] = data
+        tis = self._from_buffer(np.ndarray((shm.size,), np.uint8, shm.buf), shm.name)
+        tis._shm = shm
+        return tis
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to a TIS published with share() by its shared memory name. """
+        shm = shared_memory.SharedMemory(name=name)
+        tis = cls._from_buffer(np.ndarray((shm.size,), np.uint8, shm.buf), name)
+        tis._shm = shm
+        return tis
+
+    def unlink(self):
+        """Release the shared memory block of a TIS returned by share(). """
+        self._shm.unlink()
+
+    def __reduce__(self):
+        if hasattr(self, "_shm"):
+            return (TIS.attach, (self._shm.name,))
+        return super().__reduce__()
+
+    @classmethod
+    def _from_buffer(cls, buf, path):
+        """Build TIS on top of a uint8 buffer in the binary layout. """
+        magic, version, n, width, height = _BINARY_HEADER.unpack(
+            buf[: _BINARY_HEADER.size].tobytes()
+        )
+        if magic != _BINARY_MAGIC or version != _BINARY_VERSION:
+            raise ValueError(f"{path} is not a binary TIS")
+        start = _align(_BINARY_HEADER.size)
+        stop = start + n * 4 * n
+        compat = buf[start:stop].reshape(n, 4, n).view(bool)
+        start = _align(stop)
+        stop = start + (n + 1) * height * width * 4
+        atlas = buf[start:stop].reshape(n + 1, height, width, 4)
+
+        tis = cls.__new__(cls)
+        tis.path = path
+        tis.n = n
+        tis.width = width
+        tis.height = height
+        tis.compat = compat
+        tis.full = (1 << n) - 1
+        tis._supports = {}
+        tis.atlas = atlas
+        tis.tiles = [
+            Image.frombuffer("RGBA", (width, height), atlas[i], "raw", "RGBA", 0, 1)
+            for i in range(n)
+        ]
+        return tis
+
+    def _to_bytes(self) -> bytes:
+        """Serialize TIS into the binary layout. """
+        out = bytearray(_BINARY_HEADER.pack(
+            _BINARY_MAGIC, _BINARY_VERSION, self.n, self.width, self.height
+        ))
+        for section in (self.compat, self.atlas):
+            out += bytes(_align(len(out)) - len(out))
+            out += np.ascontiguousarray(section, dtype=np.uint8).tobytes()
+        return bytes(out)
+
+    def __getattr__(self, name):
+        # masks and mapping of a TIS on a binary buffer are built from compat
+        # on first use, so loading or attaching does not pay for them
+        if name == "masks":
+            packed = np.packbits(self.compat, axis=-1, bitorder="little")
+            self.masks = [
+                [int.from_bytes(row.tobytes(), "little") for row in hood]
+                for hood in packed
+            ]
+            return self.masks
+        if name == "mapping":
+            self.mapping = [
+                [np.flatnonzero(row).tolist() for row in hood]
+                for hood in self.compat
+            ]
+            return self.mapping
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
     def _setup(self, neighborhoods):
         self.mapping = []
         for n in neighborhoods:
             neighbors = n['neighbors']
             self.mapping.append(neighbors)
+        self._setup_masks()
         self.tiles = []
 
         for i in range(self.n):
             self.tiles.append(Image.open(f"{self.path}/tiles/{i}.png"))
+        self._setup_atlas()
+
+    def _setup_atlas(self):
+        """
+        Stack the tiles into a single (n + 1, h, w, 4) uint8 atlas,
+        the extra slot at index n is transparent and stands in for None.
+        """
+        self.atlas = np.zeros((self.n + 1, self.height, self.width, 4), dtype=np.uint8)
+        for i, tile in enumerate(self.tiles):
+            self.atlas[i] = np.asarray(tile.convert("RGBA"))
+
+    def _setup_masks(self):
+        """
+        Precompute the neighbor function as a dense (n, 4, n) boolean
+        compatibility tensor and as per (tile, direction) integer bitmasks,
+        bit k of masks[t][d] is set iff k in nids(t, d).
+        """
+        self.compat = np.zeros((self.n, 4, self.n), dtype=bool)
+        self.masks = []
+        for t, neighbors in enumerate(self.mapping):
+            row = []
+            for d, nids in enumerate(neighbors):
+                self.compat[t, d, nids] = True
+                m = 0
+                for k in nids:
+                    m |= 1 << k
+                row.append(m)
+            self.masks.append(row)
+        self.full = (1 << self.n) - 1
+        self._supports = {}
 
     def __call__(self, tid, direction):
         """
@@ -52,19 +323,66 @@ class TIS:
         assert 0 <= n < 4
         return self.mapping[t][n]
 
+    def mask(self, t, n) -> int:
+        """
+        Bitmask form of the neighbor function.
+        tile id -> direction -> bitmask of neighbor ids
+        """
+        assert 0 <= t < self.n
+        assert 0 <= n < 4
+        return self.masks[t][n]
+
+    def intersect_mask(self, u, x, v, y) -> int:
+        """
+        Bitmask of the intersection of u_x and v_y.
+        tile ids: {u, v}
+        neigbor set {x, y}
+        """
+        return self.mask(u, x) & self.mask(v, y)
+
+    def union_mask(self, u, x, v, y) -> int:
+        """
+        Bitmask of the union of u_x and v_y.
+        tile ids: {u, v}
+        neigbor set {x, y}
+        """
+        return self.mask(u, x) | self.mask(v, y)
+
+    def support(self, mask: int, n) -> int:
+        """
+        Bitmask of the tiles allowed in direction n of any tile in mask,
+        the union of the neighbor masks of its members (memoized).
+        """
+        key = (mask, n)
+        if (s := self._supports.get(key)) is None:
+            s = 0
+            for t in self.ids(mask):
+                s |= self.masks[t][n]
+            self._supports[key] = s
+        return s
+
+    @staticmethod
+    def count(mask: int) -> int:
+        """Number of tile ids in a bitmask. """
+        return mask.bit_count()
+
+    @staticmethod
+    def ids(mask: int) -> list[int]:
+        """Decode a bitmask into the ascending list of its tile ids. """
+        out = []
+        while mask:
+            low = mask & -mask
+            out.append(low.bit_length() - 1)
+            mask ^= low
+        return out
+
     def intersect(self, u, x, v, y):
         """
         Compute the intersection of u_x and v_y.
         tile ids: {u, v}
         neigbor set {x, y}
         """
-        assert 0 <= u < self.n
-        assert 0 <= v < self.n
-        assert x in [0, 1, 2, 3]
-        assert y in [0, 1, 2, 3]
-        A = set(self.nids(u, x))
-        B = set(self.nids(v, y))
-        return A.intersection(B)
+        return set(self.ids(self.intersect_mask(u, x, v, y)))
 
     def neighbors(self, i):
         """
@@ -171,21 +489,52 @@ class TIS:
                 img.paste(self.tiles[a], box=(l, m))
             img.save(f"{path}/{i}.png")
 
+    def id_array(self, fragment) -> np.ndarray:
+        """
+        convert a id matrix (indexed [col][row]) to an integer array,
+        None (or EMPTY in an integer array) is mapped to the transparent atlas slot n
+        """
+        if isinstance(fragment, np.ndarray) and fragment.dtype.kind == "i":
+            return np.where(fragment == EMPTY, self.n, fragment).astype(np.intp)
+        return np.array(
+            [[self.n if t is None else t for t in col] for col in fragment],
+            dtype=np.intp,
+        )
+
+    def render(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Render a (..., cols, rows) integer id array into a
+        (..., rows * height, cols * width, 4) uint8 pixel array.
+        """
+        *batch, cols, rows = ids.shape
+        px = self.atlas[ids]  # (..., cols, rows, h, w, 4)
+        k = len(batch)
+        px = px.transpose(*range(k), k + 1, k + 2, k, k + 3, k + 4)
+        return px.reshape(*batch, rows * self.height, cols * self.width, 4)
+
     def to_image(self, fragment):
         """
         convert a id matrix to Image
         """
-        cols = len(fragment)
-        rows = len(fragment[0])
-        img = Image.new("RGBA", (cols * self.width, rows * self.height), color=0)
-        for x, y in product(range(cols),range(rows)):
-            h = x * self.width
-            k = y * self.height
-            t = fragment[x][y]
-            if t is not None:
-                img.paste(self.tiles[t], box=(h, k))
-
-        return img
+        return Image.fromarray(self.render(self.id_array(fragment)), "RGBA")
+
+    def to_images(self, fragments) -> list:
+        """
+        convert a sequence of equally shaped id matrices to Images,
+        rendering the whole stack at once, fragments may be a (k, cols, rows) array
+        """
+        if isinstance(fragments, np.ndarray):
+            ids = self.id_array(fragments)
+        elif not fragments:
+            return []
+        else:
+            ids = np.stack([self.id_array(f) for f in fragments])
+        return [Image.fromarray(px, "RGBA") for px in self.render(ids)]
+
+
+EMPTY = -1
+"""Sentinel tile id of an undefined cell in an Individual. """
+
 """
 hashable representations for vector and matrix fragments
 """
@@ -200,50 +549,306 @@ def M(a:int|None, b:int|None, c:int|None, d:int|None):
     """
     return a, b, c, d
 
+class ImageWriter:
+    """
+    Pipelined output stage, renders and saves images on a thread pool while
+    the caller keeps generating (PIL releases the GIL while encoding).
+    At most `pending` tasks are queued, submitting more blocks until one
+    finishes. flush() and close() wait for every task and raise the first error.
+    """
+    def __init__(self, workers:int|None=None, pending:int|None=None):
+        workers = workers or min(8, cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(workers)
+        self._slots = BoundedSemaphore(pending or 2 * workers)
+        self._futures = set()
+        self._lock = Lock()
+        self._errors = []
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on the pool. """
+        if self._errors:
+            raise self._errors[0]
+        self._slots.acquire()
+        future = self._pool.submit(fn, *args)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+
+    def save(self, fname:str, render, *args):
+        """Render an image with render(*args) and save it to fname on the pool. """
+        self.submit(lambda: render(*args).save(fname))
+
+    def flush(self):
+        """Wait for every task submitted so far. """
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        if self._errors:
+            raise self._errors[0]
+
+    def _done(self, future):
+        if (e := future.exception()) is not None:
+            self._errors.append(e)
+        with self._lock:
+            self._futures.discard(future)
+        self._slots.release()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        if self._errors:
+            raise self._errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GifWriter:
+    """
+    Streaming GIF encoder for tiled images.
+    Keeps a single palette indexed canvas, tiles are repainted onto it as
+    they change and each frame only encodes the bounding box of the tiles
+    changed since the previous frame, so memory is bounded by two frames.
+    Frames are drawn over the previous ones. Frames are written one behind,
+    when a frame turns pixels transparent (e.g. a cleared tile) the frame
+    before it is widened to cover its box and restores that box to the
+    (transparent) background once shown, the frame then repaints the box.
+    """
+    TRANSPARENT = 255
+
+    def __init__(self, fname:str, tis:TIS, ids:np.ndarray, duration:int|None=None, loop=0):
+        self.tis = tis
+        self.duration = duration
+        self.cols, self.rows = ids.shape
+        palette, self.atlas = self._index_atlas(tis)
+        self.canvas = np.ascontiguousarray(
+            self.atlas[tis.id_array(ids)].transpose(1, 2, 0, 3).reshape(
+                self.rows * tis.height, self.cols * tis.width
+            )
+        )
+        self._dirty = None
+        self._clear = False  # some pixel of the dirty box turned transparent
+        # the canvas as of the last frame, whose box is not written yet
+        self._shown = self.canvas.copy()
+        self._pending = (0, 0, self.cols, self.rows)
+        self.fp = open(fname, "wb")
+        height, width = self.canvas.shape
+        self.fp.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xF7, 0, 0))
+        self.fp.write(palette)
+        # NETSCAPE2.0 application extension, loop count
+        self.fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+    @classmethod
+    def _index_atlas(cls, tis:TIS) -> tuple[bytes, np.ndarray]:
+        """
+        Map the tile atlas onto a 256 color palette, index TRANSPARENT is
+        reserved for (mostly) transparent pixels and the None slot.
+        Returns the palette bytes and a (n + 1, h, w) uint8 index atlas.
+        """
+        px = np.asarray(tis.atlas).reshape(-1, 4)
+        opaque = px[:, 3] >= 128
+        rgb = px[opaque, :3]
+        colors, inverse = np.unique(rgb, axis=0, return_inverse=True)
+        if len(colors) > cls.TRANSPARENT:
+            q = Image.fromarray(rgb.reshape(1, -1, 3)).quantize(cls.TRANSPARENT)
+            inverse = np.asarray(q).ravel()
+            colors = np.array(q.getpalette()[: 3 * cls.TRANSPARENT], dtype=np.uint8).reshape(-1, 3)
+        index = np.full(len(px), cls.TRANSPARENT, dtype=np.uint8)
+        index[opaque] = inverse.ravel()
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        palette[: len(colors)] = colors
+        return palette.tobytes(), index.reshape(tis.n + 1, tis.height, tis.width)
+
+    def paste(self, x:int, y:int, t:int|None):
+        """Repaint the tile at (x, y) with t. """
+        x %= self.cols
+        y %= self.rows
+        if t is None or t == EMPTY:
+            t = self.tis.n
+        h, w = self.tis.height, self.tis.width
+        cell = self.canvas[y * h:(y + 1) * h, x * w:(x + 1) * w]
+        tile = self.atlas[t]
+        if not self._clear:
+            self._clear = bool(((tile == self.TRANSPARENT) & (cell != self.TRANSPARENT)).any())
+        cell[...] = tile
+        if self._dirty is None:
+            self._dirty = (x, y, x + 1, y + 1)
+        else:
+            x0, y0, x1, y1 = self._dirty
+            self._dirty = (min(x0, x), min(y0, y), max(x1, x + 1), max(y1, y + 1))
+
+    def frame(self):
+        """Encode the tiles changed since the last frame as a new frame. """
+        if self._dirty is not None:
+            box = self._dirty
+            if self._clear:
+                x0, y0, x1, y1 = self._pending
+                u0, v0, u1, v1 = box
+                box = (min(x0, u0), min(y0, v0), max(x1, u1), max(y1, v1))
+                self._emit(*box, disposal=2)
+            else:
+                self._emit(*self._pending, disposal=1)
+            x0, y0, x1, y1 = box
+            h, w = self.tis.height, self.tis.width
+            self._shown[y0 * h:y1 * h, x0 * w:x1 * w] = self.canvas[y0 * h:y1 * h, x0 * w:x1 * w]
+            self._pending = box
+            self._dirty = None
+            self._clear = False
+
+    def close(self):
+        self.frame()
+        self._emit(*self._pending, disposal=1)
+        self.fp.write(b";")
+        self.fp.close()
+
+    def _emit(self, x0:int, y0:int, x1:int, y1:int, disposal:int):
+        """
+        Encode the tile box (x0, y0) - (x1, y1) of the last frame as a frame.
+        disposal    1 leaves it in place for the next frame to be drawn over,
+                    2 restores its box to the background once shown
+        """
+        h, w = self.tis.height, self.tis.width
+        region = self._shown[y0 * h:y1 * h, x0 * w:x1 * w]
+        params = {"transparency": self.TRANSPARENT, "disposal": disposal}
+        if self.duration is not None:
+            params["duration"] = self.duration
+        for data in GifImagePlugin.getdata(Image.fromarray(region), offset=(x0 * w, y0 * h), **params):
+            self.fp.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class History:
+    """
+    Append only change log that clones can share.
+    A log created with a parent sees the first `size` entries of the parent
+    followed by its own, the parent may keep appending without affecting it.
+    """
+    __slots__ = ("parent", "size", "entries")
+
+    def __init__(self, parent:"History|None"=None):
+        self.parent = parent
+        self.size = len(parent) if parent is not None else 0
+        self.entries = []
+
+    def append(self, entry):
+        self.entries.append(entry)
+
+    def __len__(self) -> int:
+        return self.size + len(self.entries)
+
+    def __iter__(self):
+        chain = []
+        log, size = self, len(self)
+        while log is not None:
+            chain.append((log, size))
+            size = log.size
+            log = log.parent
+        for log, size in reversed(chain):
+            yield from log.entries[: size - log.size]
+
+
 class Individual:
     """
     Individual image for tinkering.
     General datastructure representing images for a number of
     algorithms.
+
+    The conformity of every position, their total and a bucket queue of
+    the positions by conformity are kept up to date by set() and seed(),
+    data should not be written directly.
     """
+    __slots__ = (
+        "cols", "rows", "data", "tis",
+        "_start", "_change_history", "_conf", "_fitness", "_counts", "_queue", "_slot",
+    )
+
     def __init__(self, cols:int, rows:int, tis:TIS, rand=False):
         self.cols = cols
         self.rows = rows
-        self.data = np.full((self.cols, self.rows), None)
-        self.n = tis.n
-        self.nids = tis.nids
+        self.data = np.full((self.cols, self.rows), EMPTY, dtype=np.int16)
+        # only the TIS is referenced, a pickled Individual carries the TIS
+        # handle (the shared memory name of a shared TIS) not its tables
+        self.tis = tis
 
         self.reset(rand)
 
+    @property
+    def n(self) -> int:
+        return self.tis.n
+
+    @property
+    def nids(self):
+        return self.tis.nids
+
+    @property
+    def compat(self) -> np.ndarray:
+        return self.tis.compat
+
 
     def reset(self, rand=False):
-        self._start = deepcopy(self.data)
-        self._change_history = []
+        self._start = self.data.copy()
+        self._change_history = History()
         if rand:
             self._rand_init()
+        else:
+            self._rebuild()
+
+    def clone(self, history=True) -> "Individual":
+        """
+        Return an independent copy, only the grid and the conformity arrays
+        are copied, TIS references and the start snapshot are shared.
+        history     share the change history with self (copy free), otherwise
+                    the clone starts a fresh history from the current grid
+        """
+        other = Individual.__new__(Individual)
+        other.cols = self.cols
+        other.rows = self.rows
+        other.data = self.data.copy()
+        other.tis = self.tis
+        if history:
+            other._start = self._start
+            other._change_history = History(self._change_history)
+        else:
+            other._start = other.data.copy()
+            other._change_history = History()
+        other._conf = self._conf.copy()
+        other._fitness = self._fitness
+        other._counts = self._counts.copy()
+        other._queue = self._queue.copy()
+        other._slot = self._slot.copy()
+        return other
 
     def seed(self, x:int, y:int, t:None|int=None):
         """Seed the image at (x, y) with t (otherwise uniform rand). """
         if t is None:
             t = randint(0, self.n - 1)
-            self.data[x % self.cols][y % self.rows] = t
-        else:
-            self.data[x % self.cols][y % self.rows] = t
-
-    def to_gif(self, tis:TIS, fname:str):
-        frames = [tis.to_image(self._start)]
-        img = deepcopy(self._start)
-        for x, y, t in self._change_history:
-            img[x][y] = t
-            frames.append(tis.to_image(img))
-        frames[0].save(fname,
-			save_all = True, append_images = frames[1:],
-			optimize = False)
+        self._write(x, y, t)
+
+    def to_gif(self, tis:TIS, fname:str, stride=1, duration:int|None=None):
+        """
+        Save the change history as an animated gif.
+        stride      number of changes per frame, for time-lapses
+        duration    display time of each frame in milliseconds
+        """
+        with GifWriter(fname, tis, self._start, duration) as gif:
+            for i, (x, y, t) in enumerate(self._change_history, start=1):
+                gif.paste(x, y, t)
+                if i % stride == 0:
+                    gif.frame()
 
     def set(self, x, y, t):
         # assert(x < self.cols and y < self.rows and t < self.n)
         if x < self.cols and y < self.rows:
-            self.data[x][y] = t 
+            if t is None:
+                t = EMPTY
+            self._write(x, y, t)
             self._change_history.append((x, y, t))
 
 
@@ -255,7 +860,8 @@ class Individual:
         if t is None:
             t = self.data[x][y]
         for nid, i, j in self._neighbors(x, y):
-            if self.data[i][j] in self.nids(t, nid):
+            u = self.data[i][j]
+            if u != EMPTY and self.compat[t, nid, u]:
                 score += 1
         return score
 
@@ -263,9 +869,23 @@ class Individual:
         """
         Compute the extended conformity at (x, y)
         """
-        if t := self.data[x][y]:
+        if (t := self.data[x][y]) != EMPTY:
             return self.simple_conformity(x, y, t)
 
+    def conformity_map(self) -> np.ndarray:
+        """
+        Compute the conformity of every position at once,
+        a (cols, rows) array with -1 at undefined positions.
+        """
+        defined = self.data != EMPTY
+        t = np.where(defined, self.data, 0)
+        score = np.zeros(self.data.shape, dtype=np.int8)
+        for nid, dx, dy in ((0, 1, 0), (3, 0, 1), (2, -1, 0), (1, 0, -1)):
+            # u[x, y] is the neighbor of (x, y) in direction nid on the torus
+            u = np.roll(self.data, (-dx, -dy), axis=(0, 1))
+            score += (u != EMPTY) & self.compat[t, nid, np.where(u != EMPTY, u, 0)]
+        return np.where(defined, score, -1)
+
     def conform(self, x:int, y:int):
         """(x, y)'s neighborbood is made to conform with it w.r.t. tis. """
         t = self.data[x][y]
@@ -278,11 +898,7 @@ class Individual:
 
     def fitness(self) -> int:
         """Compute the fitness, aka the sum of each tiles conformity. """
-        score = 0
-        for x, y in self._positions():
-            if v := self.conformity(x, y):
-                score += v 
-        return score
+        return self._fitness
 
     def mutate(self):
         """Set a random location to a random tile. """
@@ -297,22 +913,14 @@ class Individual:
 
     def min_conform(self) -> tuple[int, int] | None:
         """Return the position with minimum conformity or None. """
-        c = None
-        i, j = -1, -1
-        for x, y in self._positions():
-            if v := self.conformity(x, y):
-                if v == 0:
-                    return x, y
-                if v < 4 and (c is None or v < c):
-                    c = v
-                    i, j = x, y
-        if c is not None: 
-            return i, j
+        for c, count in enumerate(self._counts):
+            if count:
+                return divmod(int(self._queue[c, 0]), self.rows)
 
     def undefined(self):
         """return each point (x, y) that is undefined in the image (self.data). """
         for x, y in self._positions():
-            if self.data[x][y] is None:
+            if self.data[x][y] == EMPTY:
                 yield x, y
 
     def H(self, x:int, y:int):
@@ -366,80 +974,77 @@ class Individual:
 
     def rule_query(self, x:int, y:int):
         if x + 1 < self.cols - 1:
-            a = self.data[x][y]
-            b = self.data[x + 1][y]
+            a = self._at(x, y)
+            b = self._at(x + 1, y)
             yield V(a, b, 0)
         if x - 1 >= 0:
-            a = self.data[x][y]
-            b = self.data[x - 1][y]
+            a = self._at(x, y)
+            b = self._at(x - 1, y)
             yield V(a, b, 2)
         if y + 1 < self.rows - 1:
-            a = self.data[x][y]
-            b = self.data[x][y + 1]
+            a = self._at(x, y)
+            b = self._at(x, y + 1)
             yield V(a, b, 1)
         if y - 1 >= 0:
-            a = self.data[x][y]
-            b = self.data[x][y - 1]
+            a = self._at(x, y)
+            b = self._at(x, y - 1)
             yield V(a, b, 3)
 
     def empty(self) -> bool:
-        for x, y in self._positions():
-            if self.data[x][y] is None:
-                return False
-        return True
+        return not (self.data == EMPTY).any()
 
     def _rule_match_candidate_V(self):
         for x, y in self._positions():
             if x + 1 < self.cols - 1:
-                a = self.data[x][y]
-                b = self.data[x + 1][y]
+                a = self._at(x, y)
+                b = self._at(x + 1, y)
                 yield (x, y), V(a, b, 0)
             if x - 1 >= 0:
-                a = self.data[x][y]
-                b = self.data[x - 1][y]
+                a = self._at(x, y)
+                b = self._at(x - 1, y)
                 yield (x, y), V(a, b, 2)
             if y + 1 < self.rows - 1:
-                a = self.data[x][y]
-                b = self.data[x][y + 1]
+                a = self._at(x, y)
+                b = self._at(x, y + 1)
                 yield (x, y), V(a, b, 1)
             if y - 1 >= 0:
-                a = self.data[x][y]
-                b = self.data[x][y - 1]
+                a = self._at(x, y)
+                b = self._at(x, y - 1)
                 yield (x, y), V(a, b, 3)
 
     def _rule_match_candidate_M(self):
         for x, y in self._positions():
-            i = self.data[x][y]
+            i = self._at(x, y)
             # upper right
             # a u
             # i b
             if x + 1 < self.cols and y - 1 >= 0:
-                a = self.data[x][y - 1]
-                b = self.data[x + 1][y]
-                u = self.data[x + 1][y - 1]
+                a = self._at(x, y - 1)
+                b = self._at(x + 1, y)
+                u = self._at(x + 1, y - 1)
                 yield (x, y), M(a, u, i, b)
             # upper left
             # u a
             # b i
             if x - 1 >= 0 and y - 1 >= 0:
-                a = self.data[x][y - 1]
-                b = self.data[x - 1][y]
-                u = self.data[x - 1][y - 1]
+                a = self._at(x, y - 1)
+                b = self._at(x - 1, y)
+                u = self._at(x - 1, y - 1)
             # bottom right
             # i a
             # b u
             if x + 1 < self.cols - 1 and y + 1 < self.rows - 1:
-                a = self.data[x + 1][y]
-                b = self.data[x][y + 1]
-                u = self.data[x + 1][y + 1]
+                a = self._at(x + 1, y)
+                b = self._at(x, y + 1)
+                u = self._at(x + 1, y + 1)
                 yield (x, y), M(i, a, b, u)
             # bottom left
             # a i
             # u b
             if x - 1 >= 0 and y + 1 < self.rows - 1:
-                a = self.data[x - 1][y]
-                b = self.data[x][y + 1]
-                u = self.data[x - 1][y + 1]
+                a = self._at(x - 1, y)
+                b = self._at(x, y + 1)
+                u = self._at(x - 1, y + 1)
                 yield (x, y), M(a, i, u, b)
 
     def _positions(self):
@@ -449,19 +1054,73 @@ class Individual:
     def _empty_positions(self):
         """Return an iterator over all empty positions. """
         for x, y in self._positions():
-            if self.data[x][y] is None:
+            if self.data[x][y] == EMPTY:
                 yield x, y
 
     def _empty_neighbors(self, x:int, y:int):
         for _, i, j in self._neighbors(x, y):
-            if self.data[i][j] is None:
+            if self.data[i][j] == EMPTY:
                 yield i, j
 
     def _defined_neighbors(self, x:int, y:int):
         for _, i, j in self._neighbors(x, y):
-            if self.data[i][j] is not None:
+            if self.data[i][j] != EMPTY:
                 yield i, j
 
+    def _rebuild(self):
+        """Recompute the conformity cache from scratch. """
+        self._conf = self.conformity_map()
+        self._fitness = int(self._conf[self._conf > 0].sum())
+        # bucket queue of the defined positions with conformity c < 4,
+        # _queue[c, :_counts[c]] holds their flat indices x * rows + y and
+        # _slot[p] the index of p within its bucket (-1 outside the queue)
+        conf = self._conf.ravel()
+        self._queue = np.zeros((4, conf.size), dtype=np.int32)
+        self._slot = np.full(conf.size, -1, dtype=np.int32)
+        self._counts = []
+        for c in range(4):
+            p = np.flatnonzero(conf == c)
+            self._queue[c, :len(p)] = p
+            self._slot[p] = np.arange(len(p))
+            self._counts.append(len(p))
+
+    def _refresh(self, x:int, y:int):
+        """Update the conformity cache at (x, y). """
+        old = int(self._conf[x, y])
+        t = self.data[x, y]
+        new = -1 if t == EMPTY else self.simple_conformity(x, y, t)
+        if old == new:
+            return
+        p = x * self.rows + y
+        if 0 <= old < 4:
+            # swap remove p from its bucket
+            self._counts[old] -= 1
+            i, last = self._slot[p], self._queue[old, self._counts[old]]
+            self._queue[old, i] = last
+            self._slot[last] = i
+            self._slot[p] = -1
+        if 0 <= new < 4:
+            self._queue[new, self._counts[new]] = p
+            self._slot[p] = self._counts[new]
+            self._counts[new] += 1
+        self._fitness += max(new, 0) - max(old, 0)
+        self._conf[x, y] = new
+
+    def _write(self, x:int, y:int, t:int):
+        """Set (x, y) to t and update the conformity of it and its neighbors. """
+        x %= self.cols
+        y %= self.rows
+        self.data[x, y] = t
+        self._refresh(x, y)
+        for p in {(i, j) for _, i, j in self._neighbors(x, y)}:
+            self._refresh(*p)
+
+    def _at(self, x:int, y:int) -> int | None:
+        """Return the tile id at (x, y), None if undefined. """
+        t = self.data[x][y]
+        if t != EMPTY:
+            return int(t)
+
     def _neighbors(self, x, y):
         """Return an iterator of the neighbors of (x, y) on a torus. """
         yield 0, (x + 1) % self.cols, y
@@ -481,6 +1140,7 @@ class Individual:
         """Set each position to a random valid value. """
         for x, y in self._positions():
             self.data[x][y] = self._rand_individual()
+        self._rebuild()
 
     def _max_score(self) -> int:
         """Return the maximum conformity score, aka each tile is fully accepted. """